@@ -3,33 +3,153 @@
 # See the file 'LICENSE' for copying permission.
 
 import functools
+import mmap
 import re
-from androguard.core.analysis.analysis import MethodAnalysis
+import sys
+from androguard.core.analysis.analysis import Analysis, MethodAnalysis
+from androguard.core.bytecodes.apk import APK
+from androguard.core.bytecodes.dvm import DalvikVMFormat
 from androguard.core.bytecodes.dvm_types import Operand
-from androguard.misc import AnalyzeAPK, AnalyzeDex
+from androguard.decompiler.decompiler import DecompilerDAD
 from collections import defaultdict
 from os import PathLike
-from typing import Dict, List, Optional, Set, Union
+from typing import Dict, FrozenSet, Generator, List, Optional, Set, Tuple, Union
+from weakref import WeakKeyDictionary
 
-from quark.core.interface.baseapkinfo import BaseApkinfo
+from quark.core.interface.baseapkinfo import BaseApkinfo, MethodIndex
 from quark.core.struct.bytecodeobject import BytecodeObject
 from quark.core.struct.methodobject import MethodObject
 
+# invoke-kind and invoke-kind/range
+_INVOKE_OPCODES = range(0x6E, 0x79)
+# invoke-polymorphic and invoke-polymorphic/range
+_INVOKE_POLYMORPHIC_OPCODES = (0xFA, 0xFB)
+
+
+@functools.lru_cache(maxsize=4096)
+def _build_method_regex(
+    class_name: Optional[str], method_name: Optional[str], descriptor: Optional[str]
+):
+    """
+    Build the regexes used by androguard to search a method.
+    A missing argument is treated as a wildcard.
+
+    :param class_name: the class name of the method
+    :param method_name: the method name of the method
+    :param descriptor: the descriptor of the method
+    :return: a tuple of regexes for the class name, method name and descriptor
+    """
+    regex_class_name = re.escape(class_name) if class_name else ".*"
+    regex_method_name = f"^{re.escape(method_name)}$" if method_name else ".*"
+    regex_descriptor = re.escape(descriptor) if descriptor else ".*"
+
+    return regex_class_name, regex_method_name, regex_descriptor
+
+
+@functools.lru_cache(maxsize=64)
+def _intern_access_flags(access_flags: str) -> str:
+    """
+    Return a shared instance of the given access flags string. Only a
+    handful of distinct flag combinations exist in an apk.
+
+    :param access_flags: the access flags of a method, e.g. "public static"
+    :return: the interned access flags string
+    """
+    return sys.intern(str(access_flags))
+
+
+def _split_operands(operands: List[tuple]) -> Tuple[List[str], Optional[str]]:
+    """
+    Split the operands of an instruction into its registers and the
+    parameter following them.
+
+    :param operands: the operands of an instruction from androguard
+    :return: a tuple of the register list and the parameter, or None if absent
+    """
+    index_of_parameter_starts = len(operands) - 1
+    while index_of_parameter_starts >= 0 and isinstance(
+        operands[index_of_parameter_starts][0], Operand
+    ):
+        index_of_parameter_starts -= 1
+
+    if index_of_parameter_starts < 0:
+        return [f"v{operand[1]}" for operand in operands], None
+
+    parameter = operands[index_of_parameter_starts]
+    parameter = parameter[2] if len(parameter) == 3 else parameter[1]
+
+    return [
+        f"v{operand[1]}" for operand in operands[:index_of_parameter_starts]
+    ], parameter
+
 
 class AndroguardImp(BaseApkinfo):
     """Information about apk based on androguard analysis"""
 
-    __slots__ = ("apk", "dalvikvmformat", "analysis")
+    __slots__ = (
+        "apk",
+        "dalvikvmformat",
+        "analysis",
+        "_instruction_cache",
+        "_upperfunc_cache",
+        "_lowerfunc_cache",
+        "_wrapper_smali_cache",
+        "_invoke_index_cache",
+        "_method_object_cache",
+        "_method_index",
+        "_method_triples",
+        "_strings",
+        "_class_hierarchy",
+        "_xref_created",
+    )
 
     def __init__(self, apk_filepath: Union[str, PathLike]):
         super().__init__(apk_filepath, "androguard")
 
+        self._instruction_cache = WeakKeyDictionary()
+        # MethodAnalysis instances live as long as self.analysis,
+        # so their ids are stable keys for the caches below.
+        self._upperfunc_cache = {}
+        self._lowerfunc_cache = {}
+        self._wrapper_smali_cache = {}
+        self._invoke_index_cache = {}
+        self._method_object_cache = {}
+        self._method_index = None
+        self._method_triples = None
+        self._strings = None
+        self._class_hierarchy = None
+        self._xref_created = False
+
         if self.ret_type == "APK":
-            # return the APK, list of DalvikVMFormat, and Analysis objects
-            self.apk, self.dalvikvmformat, self.analysis = AnalyzeAPK(apk_filepath)
+            # Same as AnalyzeAPK from androguard, except that the xrefs
+            # are created on first use.
+            self.apk = APK(apk_filepath)
+            self.dalvikvmformat = []
+            self.analysis = Analysis()
+
+            for dex in self.apk.get_all_dex():
+                dalvikvmformat = DalvikVMFormat(
+                    dex, using_api=self.apk.get_target_sdk_version()
+                )
+                self.analysis.add(dalvikvmformat)
+                self.dalvikvmformat.append(dalvikvmformat)
+                dalvikvmformat.set_decompiler(
+                    DecompilerDAD(self.dalvikvmformat, self.analysis)
+                )
         elif self.ret_type == "DEX":
-            # return the sha256hash, DalvikVMFormat, and Analysis objects
-            _, _, self.analysis = AnalyzeDex(apk_filepath)
+            # Parse the DEX from a memory map rather than a bytes copy, and
+            # bypass the default androguard session, which keeps every
+            # analyzed DEX alive.
+            with open(apk_filepath, "rb") as dex_file, mmap.mmap(
+                dex_file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as dex_buffer:
+                dalvikvmformat = DalvikVMFormat(dex_buffer)
+
+            self.dalvikvmformat = [dalvikvmformat]
+            self.analysis = Analysis(dalvikvmformat)
+
+            dalvikvmformat.set_decompiler(DecompilerDAD(dalvikvmformat, self.analysis))
+            dalvikvmformat.set_vmanalysis(self.analysis)
         else:
             raise ValueError("Unsupported File type.")
 
@@ -42,88 +162,147 @@ class AndroguardImp(BaseApkinfo):
             return []
 
     @property
-    def android_apis(self) -> Set[MethodObject]:
-        apis = set()
-
-        for external_cls in self.analysis.get_external_classes():
-            for meth_analysis in external_cls.get_methods():
-                if meth_analysis.is_android_api():
-                    apis.add(meth_analysis)
-
-        return {self._convert_to_method_object(api) for api in apis}
+    def android_apis(self) -> FrozenSet[MethodObject]:
+        return self._get_method_index().android_apis
 
     @property
-    def custom_methods(self) -> Set[MethodObject]:
-        return {
-            self._convert_to_method_object(meth_analysis)
-            for meth_analysis in self.analysis.get_methods()
-            if not meth_analysis.is_external()
-        }
+    def custom_methods(self) -> FrozenSet[MethodObject]:
+        return self._get_method_index().custom_methods
 
     @property
-    def all_methods(self) -> Set[MethodObject]:
-        return {
-            self._convert_to_method_object(meth_analysis)
-            for meth_analysis in self.analysis.get_methods()
-        }
+    def all_methods(self) -> FrozenSet[MethodObject]:
+        return self._get_method_index().all_methods
+
+    def _get_method_index(self) -> MethodIndex:
+        """
+        Classify all methods into Android APIs, custom methods and all
+        methods in a single walk. The result is built once and cached.
+
+        :return: a MethodIndex of three frozensets of MethodObject
+        """
+        if self._method_index is None:
+            self._ensure_xref()
+
+            apis, custom_methods, all_methods = set(), set(), set()
+            convert = self._convert_to_method_object
+
+            for class_analysis in self.analysis.get_classes():
+                is_external_class = class_analysis.is_external()
+
+                for method_analysis in class_analysis.get_methods():
+                    method_object = convert(method_analysis)
+                    all_methods.add(method_object)
+
+                    if not method_analysis.is_external():
+                        custom_methods.add(method_object)
+                    elif is_external_class and method_analysis.is_android_api():
+                        apis.add(method_object)
+
+            self._method_index = MethodIndex(
+                frozenset(apis), frozenset(custom_methods), frozenset(all_methods)
+            )
+
+        return self._method_index
+
+    def _get_method_triples(self) -> Dict[Tuple[str, str, str], MethodAnalysis]:
+        """
+        Map the class name, method name and descriptor of every method to
+        its MethodAnalysis. The mapping is built once and cached.
+
+        :return: a dict from (class name, method name, descriptor) tuples
+            to MethodAnalysis instances
+        """
+        if self._method_triples is None:
+            self._ensure_xref()
+
+            self._method_triples = {
+                (
+                    str(method_analysis.class_name),
+                    str(method_analysis.name),
+                    str(method_analysis.descriptor),
+                ): method_analysis
+                for method_analysis in self.analysis.get_methods()
+            }
+
+        return self._method_triples
 
-    @functools.lru_cache()
     def find_method(
         self,
         class_name: Optional[str] = ".*",
         method_name: Optional[str] = ".*",
         descriptor: Optional[str] = ".*",
     ) -> MethodObject:
-        regex_class_name = re.escape(class_name)
-        regex_method_name = f"^{re.escape(method_name)}$"
-        regex_descriptor = re.escape(descriptor)
+        self._ensure_xref()
+
+        if class_name and method_name and descriptor:
+            # Fully specified, look it up directly instead of matching
+            # every method in the apk with regexes.
+            method_analysis = self._get_method_triples().get(
+                (class_name, method_name, descriptor)
+            )
+            if method_analysis is None:
+                return None
+
+            return self._convert_to_method_object(method_analysis)
+
+        regex_class_name, regex_method_name, regex_descriptor = _build_method_regex(
+            class_name, method_name, descriptor
+        )
 
         method_result = self.analysis.find_methods(
             classname=regex_class_name,
             methodname=regex_method_name,
             descriptor=regex_descriptor,
         )
-        if list(method_result):
-            (result,) = list(
-                self.analysis.find_methods(
-                    classname=regex_class_name,
-                    methodname=regex_method_name,
-                    descriptor=regex_descriptor,
-                )
-            )
 
-            return self._convert_to_method_object(result)
-        else:
+        # Overloads may all match a partial query, take the first one
+        result = next(method_result, None)
+        if result is None:
             return None
 
-    @functools.lru_cache()
+        return self._convert_to_method_object(result)
+
     def upperfunc(self, method_object: MethodObject) -> Set[MethodObject]:
         method_analysis = method_object.cache
-        return {
-            self._convert_to_method_object(call)
-            for _, call, _ in method_analysis.get_xref_from()
-        }
+
+        upperfunc_set = self._upperfunc_cache.get(id(method_analysis))
+        if upperfunc_set is None:
+            self._ensure_xref()
+
+            convert = self._convert_to_method_object
+            upperfunc_set = {
+                convert(call) for _, call, _ in method_analysis.get_xref_from()
+            }
+            self._upperfunc_cache[id(method_analysis)] = upperfunc_set
+
+        return upperfunc_set
 
     def lowerfunc(self, method_object: MethodObject) -> Set[MethodObject]:
         method_analysis = method_object.cache
-        return {
-            (self._convert_to_method_object(call), offset)
-            for _, call, offset in method_analysis.get_xref_to()
-        }
+
+        lowerfunc_set = self._lowerfunc_cache.get(id(method_analysis))
+        if lowerfunc_set is None:
+            self._ensure_xref()
+
+            convert = self._convert_to_method_object
+            xrefs = method_analysis.get_xref_to()
+
+            # A method may be called at several offsets, convert it once.
+            method_objects = {id(call): convert(call) for _, call, _ in xrefs}
+            lowerfunc_set = {
+                (method_objects[id(call)], offset) for _, call, offset in xrefs
+            }
+            self._lowerfunc_cache[id(method_analysis)] = lowerfunc_set
+
+        return lowerfunc_set
 
     def get_method_bytecode(self, method_object: MethodObject) -> Set[MethodObject]:
         method_analysis = method_object.cache
         try:
-            for (
-                _,
-                ins,
-            ) in method_analysis.get_method().get_instructions_idx():
-                bytecode_obj = None
-                reg_list = []
-
-                # count the number of the registers.
-                length_operands = len(ins.get_operands())
-                if length_operands == 0:
+            for _, ins in self._get_instructions(method_analysis):
+                operands = ins.get_operands()
+
+                if not operands:
                     # No register, no parameter
                     bytecode_obj = BytecodeObject(
                         ins.get_name(),
@@ -131,29 +310,7 @@ class AndroguardImp(BaseApkinfo):
                         None,
                     )
                 else:
-                    index_of_parameter_starts = None
-                    for i in range(length_operands - 1, -1, -1):
-                        if not isinstance(ins.get_operands()[i][0], Operand):
-                            index_of_parameter_starts = i
-                            break
-
-                    if index_of_parameter_starts is not None:
-                        parameter = ins.get_operands()[index_of_parameter_starts]
-                        parameter = (
-                            parameter[2] if len(parameter) == 3 else parameter[1]
-                        )
-
-                        for i in range(index_of_parameter_starts):
-                            reg_list.append(
-                                "v" + str(ins.get_operands()[i][1]),
-                            )
-                    else:
-                        parameter = None
-                        for i in range(length_operands):
-                            reg_list.append(
-                                "v" + str(ins.get_operands()[i][1]),
-                            )
-
+                    reg_list, parameter = _split_operands(operands)
                     bytecode_obj = BytecodeObject(ins.get_name(), reg_list, parameter)
 
                 yield bytecode_obj
@@ -161,11 +318,47 @@ class AndroguardImp(BaseApkinfo):
             # TODO Log the rule here
             pass
 
-    def get_strings(self) -> str:
-        return {
-            str(string_analysis.get_orig_value())
-            for string_analysis in self.analysis.get_strings()
-        }
+    def iter_strings(self) -> Generator[str, None, None]:
+        """
+        Yield each string inside the apk without building a set of them.
+
+        :return: a generator of strings
+        """
+        self._ensure_xref()
+
+        for string_analysis in self.analysis.get_strings():
+            yield str(string_analysis.get_orig_value())
+
+    def get_strings(self) -> FrozenSet[str]:
+        if self._strings is None:
+            self._strings = frozenset(self.iter_strings())
+
+        return self._strings
+
+    def _ensure_xref(self) -> None:
+        """
+        Create the xrefs of the analysis if they are not created yet.
+        External classes, external methods and strings are only known
+        to androguard after this step.
+        """
+        if not self._xref_created:
+            self.analysis.create_xref()
+            self._xref_created = True
+
+    def _get_instructions(self, method_analysis: MethodAnalysis) -> List:
+        """
+        Return the instructions of the given method along with their
+        offsets. The result is cached for each method.
+
+        :param method_analysis: MethodAnalysis instance from androguard
+        :return: a list of (offset, instruction) tuples
+        """
+        instructions = self._instruction_cache.get(method_analysis)
+        if instructions is None:
+            instructions = list(method_analysis.get_method().get_instructions_idx())
+            self._instruction_cache[method_analysis] = instructions
+
+        return instructions
 
     @functools.lru_cache()
     def _construct_bytecode_instruction(self, instruction):
@@ -176,37 +369,16 @@ class AndroguardImp(BaseApkinfo):
         :return: a list with bytecode instructions strings
         """
         instruction_list = [instruction.get_name()]
-        reg_list = []
-
-        # count the number of the registers.
-        length_operands = len(instruction.get_operands())
-        if length_operands == 0:
-            # No register, no parameter
-            return instruction_list
-
-        elif length_operands == 1:
-            # Only one register
-
-            reg_list.append(f"v{instruction.get_operands()[length_operands - 1][1]}")
+        operands = instruction.get_operands()
 
+        if operands:
+            reg_list, parameter = _split_operands(operands)
             instruction_list.extend(reg_list)
+            if parameter is not None:
+                instruction_list.append(parameter)
 
-            return instruction_list
-        elif length_operands >= 2:
-            # the last one is parameter, the other are registers.
+        return instruction_list
 
-            parameter = instruction.get_operands()[length_operands - 1]
-            for i in range(length_operands - 1):
-                reg_list.append(
-                    "v" + str(instruction.get_operands()[i][1]),
-                )
-            parameter = parameter[2] if len(parameter) == 3 else parameter[1]
-            instruction_list.extend(reg_list)
-            instruction_list.append(parameter)
-
-            return instruction_list
-
-    @functools.lru_cache()
     def get_wrapper_smali(
         self,
         parent_method: MethodObject,
@@ -215,13 +387,6 @@ class AndroguardImp(BaseApkinfo):
     ) -> Dict[str, Union[BytecodeObject, str]]:
         method_analysis = parent_method.cache
 
-        result = {
-            "first": None,
-            "first_hex": None,
-            "second": None,
-            "second_hex": None,
-        }
-
         first_method_pattern = (
             f"{first_method.class_name}"
             f"->{first_method.name}{first_method.descriptor}"
@@ -231,37 +396,125 @@ class AndroguardImp(BaseApkinfo):
             f"->{second_method.name}{second_method.descriptor}"
         )
 
-        for _, ins in method_analysis.get_method().get_instructions_idx():
-            if first_method_pattern in str(ins):
-                result["first"] = self._construct_bytecode_instruction(ins)
-                result["first_hex"] = ins.get_hex()
-            if second_method_pattern in str(ins):
-                result["second"] = self._construct_bytecode_instruction(ins)
-                result["second_hex"] = ins.get_hex()
+        key = (id(method_analysis), first_method_pattern, second_method_pattern)
+        result = self._wrapper_smali_cache.get(key)
+        if result is not None:
+            return result
+
+        result = {
+            "first": None,
+            "first_hex": None,
+            "second": None,
+            "second_hex": None,
+        }
+
+        invoked_methods, unindexed_invokes = self._get_invoke_index(method_analysis)
+
+        def find_last_invoke(pattern):
+            offset, instruction = invoked_methods.get(pattern, (-1, None))
+            for unindexed_offset, ins_string, ins in unindexed_invokes:
+                if unindexed_offset > offset and pattern in ins_string:
+                    offset, instruction = unindexed_offset, ins
+
+            return instruction
+
+        first_ins = find_last_invoke(first_method_pattern)
+        if first_ins is not None:
+            result["first"] = self._construct_bytecode_instruction(first_ins)
+            result["first_hex"] = first_ins.get_hex()
+
+        second_ins = find_last_invoke(second_method_pattern)
+        if second_ins is not None:
+            result["second"] = self._construct_bytecode_instruction(second_ins)
+            result["second_hex"] = second_ins.get_hex()
+
+        self._wrapper_smali_cache[key] = result
 
         return result
 
-    @property
-    def class_hierarchy(self) -> Dict[str, Set[str]]:
-        hierarchy_dict = defaultdict(set)
+    def _get_invoke_index(
+        self, method_analysis: MethodAnalysis
+    ) -> Tuple[Dict[str, tuple], List[tuple]]:
+        """
+        Index the invoke instructions of the given method by the method
+        they call. The result is cached for each method.
+
+        :param method_analysis: MethodAnalysis instance from androguard
+        :return: a tuple of a dict mapping each invoked method, formatted as
+            "Lclass;->name(descriptor)return", to the (offset, instruction)
+            of its last invocation, and a list of (offset, instruction string,
+            instruction) for the invocations that can only be matched by
+            their string form
+        """
+        index = self._invoke_index_cache.get(id(method_analysis))
+        if index is None:
+            invoked_methods = {}
+            unindexed_invokes = []
+
+            for offset, ins in self._get_instructions(method_analysis):
+                op_value = ins.get_op_value()
+                if op_value in _INVOKE_OPCODES:
+                    # The last operand of invoke-kind instructions is
+                    # (kind, index, "Lclass;->name(descriptor)return")
+                    operand = ins.get_operands()[-1]
+                    if len(operand) == 3:
+                        invoked_methods[operand[2]] = (offset, ins)
+                        continue
+                elif op_value not in _INVOKE_POLYMORPHIC_OPCODES:
+                    continue
+
+                unindexed_invokes.append((offset, str(ins), ins))
+
+            index = (invoked_methods, unindexed_invokes)
+            self._invoke_index_cache[id(method_analysis)] = index
+
+        return index
+
+    def cache_info(self) -> Dict[str, int]:
+        """
+        Return the number of cached results of the xref and wrapper
+        lookups, for profiling purposes.
 
-        for _class in self.analysis.get_classes():
-            hierarchy_dict[str(_class.name)].add(str(_class.extends))
-            hierarchy_dict[str(_class.name)].union(
-                str(implements) for implements in _class.implements
+        :return: a dict mapping the method name to its number of cache entries
+        """
+        return {
+            "upperfunc": len(self._upperfunc_cache),
+            "lowerfunc": len(self._lowerfunc_cache),
+            "get_wrapper_smali": len(self._wrapper_smali_cache),
+            "invoke_index": len(self._invoke_index_cache),
+        }
+
+    @property
+    def class_hierarchy(self) -> Dict[str, FrozenSet[str]]:
+        if self._class_hierarchy is None:
+            self._ensure_xref()
+
+            _str = str
+            self._class_hierarchy = defaultdict(
+                frozenset,
+                {
+                    _str(_class.name): frozenset(
+                        (_str(_class.extends), *map(_str, _class.implements))
+                    )
+                    for _class in self.analysis.get_classes()
+                },
             )
 
-        return hierarchy_dict
+        return self._class_hierarchy
 
-    @staticmethod
-    @functools.lru_cache
     def _convert_to_method_object(
+        self,
         method_analysis: MethodAnalysis,
     ) -> MethodObject:
-        return MethodObject(
-            access_flags=method_analysis.access,
-            class_name=str(method_analysis.class_name),
-            name=str(method_analysis.name),
-            descriptor=str(method_analysis.descriptor),
-            cache=method_analysis,
-        )
+        method_object = self._method_object_cache.get(id(method_analysis))
+        if method_object is None:
+            method_object = MethodObject(
+                access_flags=_intern_access_flags(method_analysis.access),
+                class_name=str(method_analysis.class_name),
+                name=str(method_analysis.name),
+                descriptor=str(method_analysis.descriptor),
+                cache=method_analysis,
+            )
+            self._method_object_cache[id(method_analysis)] = method_object
+
+        return method_object
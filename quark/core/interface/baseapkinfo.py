@@ -1,12 +1,15 @@
 import hashlib
 import os.path
 from abc import abstractmethod
+from collections import namedtuple
 from os import PathLike
-from typing import Dict, List, Optional, Set, Union
+from typing import Dict, Generator, List, Optional, Set, Union
 
 from quark.core.struct.bytecodeobject import BytecodeObject
 from quark.core.struct.methodobject import MethodObject
 
+MethodIndex = namedtuple("method_index", "android_apis custom_methods all_methods")
+
 
 class BaseApkinfo:
 
@@ -103,12 +106,13 @@ class BaseApkinfo:
     ) -> MethodObject:
         """
         Find method from given class_name, method_name and the descriptor.
-        default is find all method.
+        An empty method_name or descriptor matches any value, and the first
+        matching method is returned.
 
         :param class_name: the class name of the Android API
         :param method_name: the method name of the Android API
         :param descriptor: the descriptor of the Android API
-        :return: a generator of MethodObject
+        :return: a MethodObject, or None if no method matches
         """
         pass
 
@@ -144,7 +148,22 @@ class BaseApkinfo:
         pass
 
     @abstractmethod
-    def get_strings(self) -> str:
+    def get_strings(self) -> Set[str]:
+        """
+        Return all strings inside the given APK.
+
+        :return: a set of strings
+        """
+        pass
+
+    @abstractmethod
+    def iter_strings(self) -> Generator[str, None, None]:
+        """
+        Yield each string inside the given APK, for callers that only
+        scan the strings once.
+
+        :return: a generator of strings
+        """
         pass
 
     @abstractmethod
@@ -170,6 +189,15 @@ class BaseApkinfo:
     @property
     @abstractmethod
     def class_hierarchy(self) -> Dict[str, Set[str]]:
+        """
+        Return the direct parents of each class in the given APK.
+
+        AndroguardImp reports both the superclass and the implemented
+        interfaces of a class. RizinImp only reports the superclass, since
+        the class graph of Rizin does not record interfaces.
+
+        :return: a dict mapping each class name to a set of its parents
+        """
         pass
 
     @staticmethod
@@ -1,25 +1,57 @@
 import functools
 import logging
 import os.path
-import re
 import rzpipe
+import shutil
 import tempfile
 import zipfile
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from os import PathLike
-from typing import Dict, Generator, List, Optional, Set, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Generator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 
 from quark.core.axmlreader import AxmlReader
-from quark.core.interface.baseapkinfo import BaseApkinfo
+from quark.core.interface.baseapkinfo import BaseApkinfo, MethodIndex
 from quark.core.struct.bytecodeobject import BytecodeObject
 from quark.core.struct.methodobject import MethodObject
 
 RizinCache = namedtuple("rizin_cache", "address dexindex is_imported")
 
+_PRIMITIVE_TYPES = frozenset("ZBCSIJFD")
+
+_COPY_BUFFER_SIZE = 1 << 16
+
 
 class RizinImp(BaseApkinfo):
 
-    __slots__ = ["_tmp_dir", "_dex_list", "_number_of_dex", "_manifest"]
+    __slots__ = [
+        "_tmp_dir",
+        "_dex_list",
+        "_dex_names",
+        "_number_of_dex",
+        "_manifest",
+        "_strings",
+        "_class_hierarchy",
+        "_class_index",
+        "_method_index",
+        "_permissions",
+    ]
 
     def __init__(
         self,
@@ -28,9 +60,16 @@ class RizinImp(BaseApkinfo):
     ):
         super().__init__(apk_filepath, "rizin")
 
+        self._strings = None
+        self._class_hierarchy = None
+        self._class_index = None
+        self._method_index = None
+        self._permissions = None
+
         if self.ret_type == "DEX":
             self._tmp_dir = None
             self._dex_list = [apk_filepath]
+            self._dex_names = None
 
         elif self.ret_type == "APK":
             self._tmp_dir = tempfile.mkdtemp() if tmp_dir is None else tmp_dir
@@ -46,28 +85,78 @@ class RizinImp(BaseApkinfo):
                     if file.startswith("classes") and file.endswith(".dex")
                 ]
 
-                for dex in dex_files:
-                    apk.extract(dex, path=self._tmp_dir)
-
-                self._dex_list = [os.path.join(self._tmp_dir, dex) for dex in dex_files]
+            # DEX files are extracted on first use by _get_rz
+            self._dex_names = dex_files
+            self._dex_list = [os.path.join(self._tmp_dir, dex) for dex in dex_files]
 
         else:
             raise ValueError("Unsupported File type.")
 
         self._number_of_dex = len(self._dex_list)
 
-    @functools.lru_cache
+    @functools.lru_cache(maxsize=None)
     def _get_rz(self, index):
+        if self._dex_names is not None:
+            self._extract_dex(index)
+
         rz = rzpipe.open(self._dex_list[index])
         rz.cmd("aa")
         return rz
 
-    @functools.lru_cache
+    def _extract_dex(self, index: int) -> None:
+        dex_path = self._dex_list[index]
+        os.makedirs(os.path.dirname(dex_path), exist_ok=True)
+
+        with zipfile.ZipFile(self.apk_filepath) as apk:
+            with apk.open(self._dex_names[index]) as source:
+                with open(dex_path, "wb") as target:
+                    shutil.copyfileobj(source, target, _COPY_BUFFER_SIZE)
+
+    @staticmethod
+    def _cmdj(rz, command: str) -> Any:
+        """
+        Run the given command and parse its JSON output. This behaves like
+        rzpipe's cmdj, but decodes with orjson when it is installed.
+
+        :param rz: the rzpipe instance to run the command
+        :param command: a Rizin command that outputs JSON
+        :return: the parsed object, or None if the output is not valid JSON
+        """
+        result = rz.cmd(command)
+        if not result or not result.strip():
+            return None
+
+        try:
+            return _json.loads(result)
+        except ValueError as error:
+            logging.debug(f"Cannot parse the output of {command}: {error}")
+            return None
+
+    def _map_dex(self, function: Callable[[int], Any]) -> List[Any]:
+        """
+        Call the given function with each DEX index and collect the results.
+        Since Rizin analyzes each DEX file in its own process, the calls run
+        in parallel threads when there is more than one DEX file.
+
+        :param function: a function that takes a DEX index
+        :return: a list of the results, ordered by DEX index
+        """
+        if self._number_of_dex <= 1:
+            return [function(dex_index) for dex_index in range(self._number_of_dex)]
+
+        max_workers = min(os.cpu_count() or 1, self._number_of_dex)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each worker gets a distinct index, so a Rizin instance
+            # is never created twice by _get_rz.
+            return list(executor.map(function, range(self._number_of_dex)))
+
+    @functools.lru_cache(maxsize=None)
     def _get_methods_classified(self, dexindex):
         rz = self._get_rz(dexindex)
 
-        method_json_list = rz.cmdj("isj")
-        method_dict = defaultdict(list)
+        method_json_list = self._cmdj(rz, "isj")
+        # Dicts keep the first occurrence and the order of the symbols
+        method_dict = defaultdict(dict)
         for json_obj in method_json_list:
             if json_obj.get("type") not in ["FUNC", "METH"]:
                 continue
@@ -79,15 +168,10 @@ class RizinImp(BaseApkinfo):
             l_index = method_descriptor.index("(")
             r_index = method_descriptor.index(")")
             methodname = method_descriptor[:l_index]
-            argument_string = method_descriptor[l_index:r_index]
-            argument_string = (
-                "("
-                + " ".join(re.findall(r"L.+?;|[ZBCSIJFD]|\[", argument_string))
-                + ")"
+            argument_string = self._convert_argument_string(
+                method_descriptor[l_index + 1 : r_index]
             )
 
-            argument_string = re.sub(r"\[ ", "[", argument_string)
-
             return_value = method_descriptor[method_descriptor.index(")") + 1 :]
             descriptor = argument_string + return_value
 
@@ -99,46 +183,108 @@ class RizinImp(BaseApkinfo):
                 descriptor=descriptor,
                 cache=RizinCache(json_obj["vaddr"], dexindex, is_imported),
             )
-            method_dict[class_name].append(method)
+            method_dict[class_name].setdefault(method, method)
+
+        return defaultdict(
+            list,
+            {
+                class_name: list(method_set)
+                for class_name, method_set in method_dict.items()
+            },
+        )
+
+    def _get_class_index(self) -> Dict[str, List[int]]:
+        if self._class_index is None:
+            class_index = defaultdict(list)
+            method_dicts = self._map_dex(self._get_methods_classified)
+
+            for dex_index, method_dict in enumerate(method_dicts):
+                for class_name, method_list in method_dict.items():
+                    if method_list:
+                        class_index[class_name].append(dex_index)
+
+            self._class_index = dict(class_index)
+
+        return self._class_index
 
-        return method_dict
+    @functools.lru_cache(maxsize=4096)
+    def _get_instruction_flow(self, dexindex: int, address: int) -> Tuple[dict, ...]:
+        rz = self._get_rz(dexindex)
+
+        function_detail = self._cmdj(rz, f"pdfj @ {address}")
+        if not function_detail:
+            return ()
+
+        return tuple(function_detail["ops"])
+
+    @functools.lru_cache(maxsize=None)
+    def _get_address_index(self, dexindex: int) -> Dict[int, MethodObject]:
+        return {
+            method.cache.address: method
+            for method_list in self._get_methods_classified(dexindex).values()
+            for method in method_list
+        }
 
     @property
     def permissions(self) -> List[str]:
-        axml = AxmlReader(self._manifest)
-        permission_list = set()
+        if self.ret_type == "DEX":
+            return []
+
+        if self._permissions is None:
+            axml = AxmlReader(self._manifest)
+            permission_set = set()
+
+            for tag in axml:
+                label = tag.get("Name")
+                if label and axml.get_string(label) == "uses-permission":
+                    attrs = axml.get_attributes(tag)
 
-        for tag in axml:
-            label = tag.get("Name")
-            if label and axml.get_string(label) == "uses-permission":
-                attrs = axml.get_attributes(tag)
+                    if attrs:
+                        permission = axml.get_string(attrs[0]["Value"])
+                        permission_set.add(permission)
 
-                if attrs:
-                    permission = axml.get_string(attrs[0]["Value"])
-                    permission_list.add(permission)
+            self._permissions = tuple(permission_set)
 
-        return permission_list
+        # A new list for each call, so callers cannot alter the cached result
+        return list(self._permissions)
 
     @property
-    def android_apis(self) -> Set[MethodObject]:
-        return {
-            method
-            for method in self.all_methods
-            if method.is_android_api() and method.cache.is_imported
-        }
+    def android_apis(self) -> FrozenSet[MethodObject]:
+        return self._get_method_index().android_apis
 
     @property
-    def custom_methods(self) -> Set[MethodObject]:
-        return {method for method in self.all_methods if not method.cache.is_imported}
+    def custom_methods(self) -> FrozenSet[MethodObject]:
+        return self._get_method_index().custom_methods
 
     @property
-    def all_methods(self) -> Set[MethodObject]:
-        method_set = set()
-        for dex_index in range(self._number_of_dex):
-            for method_list in self._get_methods_classified(dex_index).values():
-                method_set.update(method_list)
+    def all_methods(self) -> FrozenSet[MethodObject]:
+        return self._get_method_index().all_methods
+
+    def _get_method_index(self) -> MethodIndex:
+        """
+        Classify all methods into Android APIs, custom methods and all
+        methods in a single walk. The result is built once and cached.
+
+        :return: a MethodIndex of three frozensets of MethodObject
+        """
+        if self._method_index is None:
+            all_methods = set()
+            for method_dict in self._map_dex(self._get_methods_classified):
+                for method_list in method_dict.values():
+                    all_methods.update(method_list)
+
+            apis, custom_methods = set(), set()
+            for method in all_methods:
+                if not method.cache.is_imported:
+                    custom_methods.add(method)
+                elif method.is_android_api():
+                    apis.add(method)
+
+            self._method_index = MethodIndex(
+                frozenset(apis), frozenset(custom_methods), frozenset(all_methods)
+            )
 
-        return method_set
+        return self._method_index
 
     def find_method(
         self,
@@ -151,9 +297,8 @@ class RizinImp(BaseApkinfo):
                 not descriptor or descriptor == method.descriptor
             )
 
-        dex_list = range(self._number_of_dex)
-
-        for dex_index in dex_list:
+        # Only search the DEX files that define the class
+        for dex_index in self._get_class_index().get(class_name, ()):
             method_dict = self._get_methods_classified(dex_index)
             filtered_methods = filter(method_filter, method_dict[class_name])
             try:
@@ -161,13 +306,14 @@ class RizinImp(BaseApkinfo):
             except StopIteration:
                 continue
 
-    @functools.lru_cache
+    @functools.lru_cache(maxsize=None)
     def upperfunc(self, method_object: MethodObject) -> Set[MethodObject]:
         cache = method_object.cache
 
         r2 = self._get_rz(cache.dexindex)
 
-        xrefs = r2.cmdj(f"axtj @ {cache.address}")
+        xrefs = self._cmdj(r2, f"axtj @ {cache.address}")
+        address_index = self._get_address_index(cache.dexindex)
 
         upperfunc_set = set()
         for xref in xrefs:
@@ -175,7 +321,12 @@ class RizinImp(BaseApkinfo):
                 continue
 
             if "fcn_addr" in xref:
-                upperfunc_set.add(self._get_method_by_address(xref["fcn_addr"]))
+                address = xref["fcn_addr"]
+                method = address_index.get(address)
+                if method is None:
+                    method = self._get_method_by_address(address, cache.dexindex)
+
+                upperfunc_set.add(method)
             else:
                 logging.debug(
                     f"Key from was not found at searching"
@@ -184,29 +335,31 @@ class RizinImp(BaseApkinfo):
 
         return upperfunc_set
 
-    @functools.lru_cache
+    @functools.lru_cache(maxsize=None)
     def lowerfunc(self, method_object: MethodObject) -> Set[MethodObject]:
         cache = method_object.cache
 
         r2 = self._get_rz(cache.dexindex)
 
-        xrefs = r2.cmdj(f"axffj @ {cache.address}")
+        xrefs = self._cmdj(r2, f"axffj @ {cache.address}")
 
         if not xrefs:
             return set()
 
+        address_index = self._get_address_index(cache.dexindex)
+
         lowerfunc_set = set()
         for xref in xrefs:
             if xref["type"] != "CALL":
                 continue
 
             if "to" in xref:
-                lowerfunc_set.add(
-                    (
-                        self._get_method_by_address(xref["to"]),
-                        xref["from"] - cache.address,
-                    )
-                )
+                address = xref["to"]
+                method = address_index.get(address)
+                if method is None:
+                    method = self._get_method_by_address(address, cache.dexindex)
+
+                lowerfunc_set.add((method, xref["from"] - cache.address))
             else:
                 logging.debug(
                     f"Key from was not found at searching"
@@ -222,25 +375,31 @@ class RizinImp(BaseApkinfo):
 
         if not cache.is_imported:
 
-            rz = self._get_rz(cache.dexindex)
-
-            instruct_flow = rz.cmdj(f"pdfj @ {cache.address}")["ops"]
+            instruct_flow = self._get_instruction_flow(cache.dexindex, cache.address)
 
             if instruct_flow:
                 for ins in instruct_flow:
                     yield self._parse_smali(ins["disasm"])
 
-    def get_strings(self) -> Set[str]:
-        strings = set()
-        for dex_index in range(self._number_of_dex):
-            rz = self._get_rz(dex_index)
-
-            string_detail_list = rz.cmdj("izzj")
-            strings.update(
-                [string_detail["string"] for string_detail in string_detail_list]
+    def get_strings(self) -> FrozenSet[str]:
+        if self._strings is None:
+            string_detail_lists = self._map_dex(
+                lambda dex_index: self._cmdj(self._get_rz(dex_index), "izzj")
             )
 
-        return strings
+            strings = set()
+            for string_detail_list in string_detail_lists:
+                strings.update(
+                    string_detail["string"] for string_detail in string_detail_list
+                )
+
+            self._strings = frozenset(strings)
+
+        return self._strings
+
+    def iter_strings(self) -> Generator[str, None, None]:
+        # Rizin outputs all strings of a DEX file at once, so reuse the set
+        yield from self.get_strings()
 
     def get_wrapper_smali(
         self,
@@ -275,70 +434,140 @@ class RizinImp(BaseApkinfo):
         if cache.is_imported:
             return {}
 
-        rz = self._get_rz(cache.dexindex)
-
-        instruction_flow = rz.cmdj(f"pdfj @ {cache.address}")["ops"]
-
-        if instruction_flow:
-            for ins in instruction_flow:
-                if ins["disasm"].startswith("invoke"):
-                    if ";" in ins["disasm"]:
-                        index = ins["disasm"].rindex(";")
-                        instrcution_string = ins["disasm"][:index]
-
-                    if first_method_pattern in instrcution_string:
-                        result["first"] = convert_bytecode_to_list(
-                            self._parse_smali(instrcution_string)
-                        )
-                        result["first_hex"] = " ".join(
-                            map(
-                                lambda r: r.group(0),
-                                re.finditer(r"\w{2}", ins["bytes"]),
-                            )
-                        )
-                    if second_method_pattern in instrcution_string:
-                        result["second"] = convert_bytecode_to_list(
-                            self._parse_smali(instrcution_string)
-                        )
-                        result["second_hex"] = " ".join(
-                            map(
-                                lambda r: r.group(0),
-                                re.finditer(r"\w{2}", ins["bytes"]),
-                            )
-                        )
+        instruction_flow = self._get_instruction_flow(cache.dexindex, cache.address)
+
+        # Scan backwards so that the last matching invoke is kept
+        # and stop once both methods are found.
+        for ins in reversed(instruction_flow):
+            disasm = ins["disasm"]
+            if not disasm.startswith("invoke"):
+                continue
+
+            instruction_string = disasm
+            if ";" in disasm:
+                instruction_string = disasm[: disasm.rindex(";")]
+
+            is_first = (
+                result["first"] is None and first_method_pattern in instruction_string
+            )
+            is_second = (
+                result["second"] is None and second_method_pattern in instruction_string
+            )
+            if not (is_first or is_second):
+                continue
+
+            bytecode = convert_bytecode_to_list(self._parse_smali(instruction_string))
+            hex_string = ins["bytes"]
+            bytecode_hex = " ".join(
+                hex_string[index : index + 2]
+                for index in range(0, len(hex_string) - 1, 2)
+            )
+
+            if is_first:
+                result["first"] = bytecode
+                result["first_hex"] = bytecode_hex
+            if is_second:
+                result["second"] = list(bytecode)
+                result["second_hex"] = bytecode_hex
+
+            if result["first"] is not None and result["second"] is not None:
+                break
 
         return result
 
     @property
     def class_hierarchy(self) -> Dict[str, Set[str]]:
-        hierarchy_dict = defaultdict(set)
+        if self._class_hierarchy is None:
+            hierarchy_dict = defaultdict(set)
 
-        for dex_index in range(self._number_of_dex):
+            icg_outputs = self._map_dex(
+                lambda dex_index: self._get_rz(dex_index).cmd("icg")
+            )
 
-            rz = self._get_rz(dex_index)
+            for icg_output in icg_outputs:
+                hierarchy_graph = icg_output.split("\n")
 
-            hierarchy_graph = rz.cmd("icg").split("\n")
+                for element in hierarchy_graph:
+                    if element.startswith("age"):
+                        element_part = element.split()
+                        for index, class_name in enumerate(element_part):
+                            if not class_name.endswith(";"):
+                                element_part[index] = class_name + ";"
 
-            for element in hierarchy_graph:
-                if element.startswith("age"):
-                    element_part = element.split()
-                    for index, class_name in enumerate(element_part):
-                        if not class_name.endswith(";"):
-                            element_part[index] = class_name + ";"
+                        for subclass in element_part[2:]:
+                            hierarchy_dict[subclass].add(element_part[1])
 
-                    for subclass in element_part[2:]:
-                        hierarchy_dict[subclass].add(element_part[1])
+            self._class_hierarchy = hierarchy_dict
 
-        return hierarchy_dict
+        return self._class_hierarchy
 
-    def _get_method_by_address(self, address: int) -> MethodObject:
+    def _get_method_by_address(self, address: int, dexindex: int) -> MethodObject:
         if address < 0:
             return None
 
-        for method in self.all_methods:
-            if method.cache.address == address:
+        # Prefer the DEX file where the address was found
+        method = self._get_address_index(dexindex).get(address)
+        if method is not None:
+            return method
+
+        for dex_index in range(self._number_of_dex):
+            if dex_index == dexindex:
+                continue
+
+            method = self._get_address_index(dex_index).get(address)
+            if method is not None:
                 return method
 
+        return None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _convert_argument_string(arguments: str) -> str:
+        """
+        Convert the argument part of a Rizin method descriptor into the
+        space-separated form used by Quark, e.g. "[Ljava/lang/String;I" into
+        "([Ljava/lang/String; I)".
+
+        :param arguments: the argument types of a descriptor without the
+        parentheses
+        :return: the converted argument string with the parentheses
+        """
+        type_list = []
+        dimension = 0
+        index = 0
+        length = len(arguments)
+
+        while index < length:
+            char = arguments[index]
+
+            if char == "[":
+                dimension += 1
+                index += 1
+                continue
+
+            if char == "L":
+                end = arguments.find(";", index + 2)
+                if end == -1:
+                    index += 1
+                    continue
+                type_list.append("[" * dimension + arguments[index : end + 1])
+                index = end + 1
+
+            elif char in _PRIMITIVE_TYPES:
+                type_list.append("[" * dimension + char)
+                index += 1
+
+            else:
+                index += 1
+                continue
+
+            dimension = 0
+
+        if dimension:
+            type_list.append("[" * dimension)
+
+        return "(" + " ".join(type_list) + ")"
+
     @staticmethod
     def _parse_smali(smali: str) -> BytecodeObject:
         if smali == "":
@@ -353,7 +582,11 @@ class RizinImp(BaseApkinfo):
         if mnemonic.startswith("invoke"):
             args = args[: args.rfind(" ;")]
 
-        args = [arg.strip() for arg in re.split("[{},]+", args) if arg]
+        args = [
+            arg.strip()
+            for arg in args.replace("{", ",").replace("}", ",").split(",")
+            if arg
+        ]
 
         parameter = None
         # Remove the parameter at the last
@@ -362,14 +595,16 @@ class RizinImp(BaseApkinfo):
             args = args[:-1]
 
             if mnemonic.startswith("invoke"):
-                parameter = re.sub(r"\.", ";->", parameter, count=1)
+                parameter = parameter.replace(".", ";->", 1)
 
         register_list = []
         # Ranged registers
         if len(args) == 1 and (":" in args[0] or ".." in args[0]):
             register_list = args[0]
             register_list = [
-                int(reg[1:]) for reg in re.split("[:.]+", register_list) if reg
+                int(reg[1:])
+                for reg in register_list.replace(".", ":").split(":")
+                if reg
             ]
 
             if ".." in args[0]:
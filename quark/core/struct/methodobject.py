@@ -1,5 +1,27 @@
+import functools
 from dataclasses import dataclass, field
 
+# Packages found at https://developer.android.com/reference/packages
+_ANDROID_API_PREFIXES = (
+    "Landroid/",
+    "Lcom/google/android/",
+    "Ldalvik/",
+    "Ljava/",
+    "Ljavax/",
+    "Ljunit/",
+    "Lorg/apache/",
+    "Lorg/json/",
+    "Lorg/w3c/",
+    "Lorg/xml/",
+    "Lorg/xmlpull/",
+)
+
+
+# Methods of the same class share the result, so it is cached by class name
+@functools.lru_cache(maxsize=4096)
+def _is_android_api_class(class_name: str) -> bool:
+    return class_name.startswith(_ANDROID_API_PREFIXES)
+
 
 @dataclass(unsafe_hash=True)
 class MethodObject(object):
@@ -18,22 +40,7 @@ class MethodObject(object):
         return self.__str__()
 
     def is_android_api(self) -> bool:
-        # Packages found at https://developer.android.com/reference/packages
-        api_list = [
-            "Landroid/",
-            "Lcom/google/android/",
-            "Ldalvik/",
-            "Ljava/",
-            "Ljavax/",
-            "Ljunit/",
-            "Lorg/apache/",
-            "Lorg/json/",
-            "Lorg/w3c/",
-            "Lorg/xml/",
-            "Lorg/xmlpull/",
-        ]
-
-        return any(self.class_name.startswith(prefix) for prefix in api_list)
+        return _is_android_api_class(self.class_name)
 
     def __str__(self) -> str:
         return f"{self.class_name} {self.name} {self.descriptor}"
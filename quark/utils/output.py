@@ -2,6 +2,7 @@
 # This file is part of Quark-Engine - https://github.com/quark-engine/quark-engine
 # See the file 'LICENSE' for copying permission.
 
+import functools
 import json
 from collections import defaultdict
 from graphviz.dot import Digraph
@@ -49,7 +50,6 @@ def _collect_crime_description(call_graph_analysis_list):
     return report_dict
 
 
-# @functools.lru_cache
 def _search_cross_references(call_graph_analysis_list, search_depth):
     reference_dict = defaultdict(set)
 
@@ -59,18 +59,25 @@ def _search_cross_references(call_graph_analysis_list, search_depth):
     apkinfo = call_graph_analysis_list[0]["apkinfo"]
     parent_set = {item["parent"] for item in call_graph_analysis_list}
 
+    # Parents reachable from a function are the parents among its children
+    # plus those reachable from each child with one less layer. Only the
+    # parents are kept, so every (function, depth) pair is solved once.
+    @functools.lru_cache(maxsize=None)
+    def reachable_parents(function, depth):
+        parents = set()
+        for child_function, _ in apkinfo.lowerfunc(function):
+            if child_function in parent_set:
+                parents.add(child_function)
+
+            if depth > 1:
+                parents.update(reachable_parents(child_function, depth - 1))
+
+        return frozenset(parents)
+
     for parent in parent_set:
-        called_function_set = set()
-        expand_queue = {parent}
-        for _ in range(search_depth):
-            for function in expand_queue:
-                next_expand_queue = {
-                    child_function for child_function, _ in apkinfo.lowerfunc(function)
-                }
-                called_function_set.update(next_expand_queue)
-                expand_queue = next_expand_queue
-
-        referenced_set = called_function_set.intersection(parent_set)
+        referenced_set = (
+            set(reachable_parents(parent, search_depth)) if search_depth > 0 else set()
+        )
         referenced_set.discard(parent)
 
         reference_dict[parent] = referenced_set
@@ -79,21 +86,21 @@ def _search_cross_references(call_graph_analysis_list, search_depth):
 
 
 def _convert_to_printable_dict(report_dict, reference_dict):
-    printable_dict = defaultdict(list)
+    printable_dict = defaultdict(set)
 
-    for parent, reference_set in reference_dict.items():
-        key = _get_function_display_name(parent)
+    # Format each function once, however many times it is referenced
+    function_set = set(report_dict).union(reference_dict, *reference_dict.values())
+    display_names = {
+        function: _get_function_display_name(function) for function in function_set
+    }
 
-        printable_dict[key].extend(
-            [
-                f"Call {_get_function_display_name(reference)}"
-                for reference in reference_set
-            ]
+    for parent, reference_set in reference_dict.items():
+        printable_dict[display_names[parent]].update(
+            f"Call {display_names[reference]}" for reference in reference_set
         )
 
     for parent, values in report_dict.items():
-        key = _get_function_display_name(parent)
-        printable_dict[key].extend(list(values))
+        printable_dict[display_names[parent]].update(values)
 
     return printable_dict
 
@@ -115,7 +122,7 @@ def output_parent_function_table(rule_classification_data_bundle):
         ]
         tb.align = "l"
 
-        for count, crime in enumerate(set(crimes), start=1):
+        for count, crime in enumerate(sorted(crimes), start=1):
             if count == 1:
                 tb.add_row(["Crime Description", red(f"* {crime}")])
             else:
@@ -134,7 +141,7 @@ def output_parent_function_json(rule_classification_data_bundle):
         data["rules_classification"].append(
             {
                 "parent": parent,
-                "crime": crimes,
+                "crime": sorted(crimes),
             }
         )
 
@@ -152,7 +159,7 @@ def output_parent_function_graph(rule_classification_data_bundle):
     dot = Digraph(**_GRAPH_SETTINGS)
 
     for parent, identifier in identifier_dict.items():
-        descriptions = "\l".join(report_dict[parent]) + "\l"
+        descriptions = "\l".join(sorted(report_dict[parent])) + "\l"
 
         with dot.subgraph(
             name=f"cluster_{identifier}",
@@ -2,8 +2,6 @@
 # This file is part of Quark-Engine - https://github.com/quark-engine/quark-engine
 # See the file 'LICENSE' for copying permission.
 
-import copy
-
 
 def remove_dup_list(element):
     """
@@ -25,17 +23,14 @@ def contains(subset_to_check, target_list):
     then it will return False.
     """
 
-    target_copy = copy.copy(target_list)
-
-    # Delete elements that do not exist in the subset_to_check list
-    for item in target_copy:
-        if item not in subset_to_check:
-            target_copy.remove(item)
+    if not subset_to_check:
+        return True
 
-    for i in range(len(target_copy) - len(subset_to_check) + 1):
-        for j in range(len(subset_to_check)):
-            if target_copy[i + j] != subset_to_check[j]:
-                break
-        else:
-            return True
+    # Walk the target list once and advance on each element in order
+    index = 0
+    for item in target_list:
+        if item == subset_to_check[index]:
+            index += 1
+            if index == len(subset_to_check):
+                return True
     return False
@@ -1,8 +1,12 @@
+import json
 import os
 import zipfile
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
 import pytest
 import requests
+from androguard.core.bytecodes.dvm_types import Operand
 from quark.core.apkinfo import AndroguardImp
 from quark.core.interface.baseapkinfo import BaseApkinfo
 from quark.core.rzapkinfo import RizinImp
@@ -57,6 +61,33 @@ def dex_file():
     os.remove(APK_NAME)
 
 
+@pytest.fixture(scope="function")
+def fake_dex_file(tmp_path):
+    # Only the magic number is needed to be recognized as a DEX file
+    dex_path = tmp_path / "classes.dex"
+    dex_path.write_bytes(b"dex\n035\x00")
+
+    return str(dex_path)
+
+
+@pytest.fixture(scope="function")
+def mocked_androguard(fake_dex_file):
+    with patch("quark.core.apkinfo.DalvikVMFormat"), patch(
+        "quark.core.apkinfo.Analysis"
+    ):
+        apkinfo = AndroguardImp(fake_dex_file)
+
+    yield apkinfo
+
+
+@pytest.fixture(scope="function")
+def mocked_rizin(fake_dex_file):
+    with patch("quark.core.rzapkinfo.rzpipe.open"):
+        apkinfo = RizinImp(fake_dex_file)
+
+        yield apkinfo
+
+
 class TestApkinfo:
     def test_init_with_invalid_type(self):
         filepath = None
@@ -102,6 +133,15 @@ class TestApkinfo:
         ]
         assert set(apkinfo.permissions) == set(ans)
 
+    def test_permissions_with_dex(self, fake_dex_file):
+        apkinfo = RizinImp(fake_dex_file)
+
+        permissions = apkinfo.permissions
+        permissions.append("android.permission.INTERNET")
+
+        assert permissions is not apkinfo.permissions
+        assert apkinfo.permissions == []
+
     def test_android_apis(self, apkinfo):
         api = {
             MethodObject(
@@ -260,3 +300,273 @@ class TestApkinfo:
         upper_set = apkinfo.class_hierarchy[class_name]
 
         assert expected_upper_class == upper_set
+
+    def test_class_hierarchy_with_implemented_interfaces(self, mocked_androguard):
+        mocked_androguard.analysis.get_classes.return_value = [
+            SimpleNamespace(
+                name="Lcom/example/Task;",
+                extends="Ljava/lang/Object;",
+                implements=["Ljava/lang/Runnable;", "Ljava/io/Closeable;"],
+            ),
+        ]
+
+        upper_set = mocked_androguard.class_hierarchy["Lcom/example/Task;"]
+
+        assert upper_set == {
+            "Ljava/lang/Object;",
+            "Ljava/lang/Runnable;",
+            "Ljava/io/Closeable;",
+        }
+
+    def test_get_wrapper_smali_with_register_less_invoke(self, mocked_androguard):
+        def mock_instruction(op_value, name, operands):
+            instruction = MagicMock()
+            instruction.get_op_value.return_value = op_value
+            instruction.get_name.return_value = name
+            instruction.get_operands.return_value = operands
+            instruction.get_hex.return_value = name
+            return instruction
+
+        first_method = MethodObject("Lcom/example/Config;", "load", "()V")
+        second_method = MethodObject(
+            "Lcom/example/Sender;", "send", "(Ljava/lang/String;)V"
+        )
+
+        # invoke-static {}, Lcom/example/Config;->load()V
+        # invoke-virtual {v1, v2}, Lcom/example/Sender;->send(Ljava/lang/String;)V
+        instructions = [
+            (
+                0,
+                mock_instruction(
+                    0x71,
+                    "invoke-static",
+                    [(Operand.KIND + 2, 0, "Lcom/example/Config;->load()V")],
+                ),
+            ),
+            (
+                6,
+                mock_instruction(
+                    0x6E,
+                    "invoke-virtual",
+                    [
+                        (Operand.REGISTER, 1),
+                        (Operand.REGISTER, 2),
+                        (
+                            Operand.KIND + 2,
+                            1,
+                            "Lcom/example/Sender;->send(Ljava/lang/String;)V",
+                        ),
+                    ],
+                ),
+            ),
+        ]
+        method_analysis = MagicMock()
+        method_analysis.get_method.return_value.get_instructions_idx.return_value = (
+            instructions
+        )
+        parent_method = MethodObject(
+            "Lcom/example/Main;", "run", "()V", cache=method_analysis
+        )
+
+        result = mocked_androguard.get_wrapper_smali(
+            parent_method, first_method, second_method
+        )
+
+        assert result["first"] == ["invoke-static", "Lcom/example/Config;->load()V"]
+        assert result["second"] == [
+            "invoke-virtual",
+            "v1",
+            "v2",
+            "Lcom/example/Sender;->send(Ljava/lang/String;)V",
+        ]
+
+        # Another pair in the same parent must not reuse the cached result
+        result = mocked_androguard.get_wrapper_smali(
+            parent_method,
+            MethodObject("Lcom/example/Config;", "save", "()V"),
+            second_method,
+        )
+
+        assert result["first"] is None
+        assert result["first_hex"] is None
+        assert result["second"][0] == "invoke-virtual"
+
+    def test_get_methods_classified_with_duplicate_symbols(self, mocked_rizin):
+        symbols = [
+            {
+                "type": "METH",
+                "realname": "Lcom/example/Helper.method.run()V",
+                "vaddr": 0x100,
+                "is_imported": False,
+            },
+            {
+                "type": "METH",
+                "realname": "Lcom/example/Helper.method.send(Ljava/lang/String;)V",
+                "vaddr": 0x200,
+                "is_imported": False,
+            },
+            {
+                "type": "METH",
+                "realname": "Lcom/example/Helper.method.run()V",
+                "vaddr": 0x300,
+                "is_imported": False,
+            },
+            {
+                "type": "FIELD",
+                "realname": "Lcom/example/Helper.field.count",
+                "vaddr": 0x400,
+                "is_imported": False,
+            },
+        ]
+        mocked_rizin._get_rz(0).cmd.return_value = json.dumps(symbols)
+        class_name = "Lcom/example/Helper;"
+
+        method_list = mocked_rizin._get_methods_classified(0)[class_name]
+
+        # Duplicates are dropped, keeping the first one and the symbol order
+        assert method_list == [
+            MethodObject(class_name, "run", "()V"),
+            MethodObject(class_name, "send", "(Ljava/lang/String;)V"),
+        ]
+        assert [method.cache.address for method in method_list] == [0x100, 0x200]
+
+        result = mocked_rizin.find_method(class_name, "run", "()V")
+        assert result.cache.address == 0x100
+
+    def test_find_method_with_wildcard(self, mocked_rizin):
+        symbols = [
+            {
+                "type": "METH",
+                "realname": "Lcom/example/Helper.method.send(Ljava/lang/String;)V",
+                "vaddr": 0x100,
+                "is_imported": False,
+            },
+            {
+                "type": "METH",
+                "realname": "Lcom/example/Helper.method.send(I)V",
+                "vaddr": 0x200,
+                "is_imported": False,
+            },
+        ]
+        mocked_rizin._get_rz(0).cmd.return_value = json.dumps(symbols)
+        class_name = "Lcom/example/Helper;"
+
+        # An empty argument matches anything
+        result = mocked_rizin.find_method(class_name, "send", None)
+        assert result == MethodObject(class_name, "send", "(Ljava/lang/String;)V")
+
+        result = mocked_rizin.find_method(class_name, None, "(I)V")
+        assert result == MethodObject(class_name, "send", "(I)V")
+
+        # Same as AndroguardImp, ".*" is not a wildcard
+        assert mocked_rizin.find_method(class_name, "send") is None
+        assert mocked_rizin.find_method(method_name="send") is None
+
+    def test_find_method_with_overloads(self, mocked_androguard):
+        overloads = [
+            SimpleNamespace(
+                class_name="Lcom/example/Helper;",
+                name="send",
+                descriptor=descriptor,
+                access="public",
+            )
+            for descriptor in ("(Ljava/lang/String;)V", "(I)V")
+        ]
+        mocked_androguard.analysis.find_methods.return_value = iter(overloads)
+
+        result = mocked_androguard.find_method("Lcom/example/Helper;", "send", None)
+
+        assert result == MethodObject(
+            "Lcom/example/Helper;", "send", "(Ljava/lang/String;)V"
+        )
+
+    def test_iter_strings(self, mocked_rizin):
+        strings = [{"string": "hello"}, {"string": "world"}, {"string": "hello"}]
+        mocked_rizin._get_rz(0).cmd.return_value = json.dumps(strings)
+
+        assert sorted(mocked_rizin.iter_strings()) == ["hello", "world"]
+        assert set(mocked_rizin.iter_strings()) == mocked_rizin.get_strings()
+
+    def test_create_xref_on_first_use(self, mocked_androguard):
+        analysis = mocked_androguard.analysis
+        analysis.get_methods.return_value = []
+        analysis.get_classes.return_value = []
+        analysis.create_xref.assert_not_called()
+
+        mocked_androguard.find_method("Lcom/example/Helper;", "run", "()V")
+        _ = mocked_androguard.all_methods
+        mocked_androguard.upperfunc(
+            MethodObject("Lcom/example/Helper;", "run", "()V", cache=MagicMock())
+        )
+
+        analysis.create_xref.assert_called_once_with()
+
+    def test_convert_argument_string_with_primitives(self):
+        result = RizinImp._convert_argument_string("ZBCSIJFD")
+
+        assert result == "(Z B C S I J F D)"
+
+    def test_convert_argument_string_with_objects(self):
+        result = RizinImp._convert_argument_string(
+            "Ljava/lang/String;Landroid/os/Handler;"
+        )
+
+        assert result == "(Ljava/lang/String; Landroid/os/Handler;)"
+
+    def test_convert_argument_string_with_arrays(self):
+        assert RizinImp._convert_argument_string("[[I") == "([[I)"
+
+        result = RizinImp._convert_argument_string("[Ljava/lang/String;I[B")
+        assert result == "([Ljava/lang/String; I [B)"
+
+    def test_convert_argument_string_with_trailing_bracket(self):
+        assert RizinImp._convert_argument_string("I[") == "(I [)"
+        assert RizinImp._convert_argument_string("") == "()"
+
+    def test_parse_smali_with_register_list(self):
+        result = RizinImp._parse_smali("filled-new-array {v1, v2}, [I")
+
+        assert result == BytecodeObject("filled-new-array", ["v1", "v2"], "[I")
+
+    def test_parse_smali_with_ranged_registers(self):
+        result = RizinImp._parse_smali(
+            "invoke-virtual/range {v1..v3}, Lcom/example/Helper.run(II)V ; 0x5"
+        )
+        assert result == BytecodeObject(
+            "invoke-virtual/range",
+            ["v1", "v2", "v3"],
+            "Lcom/example/Helper;->run(II)V",
+        )
+
+        result = RizinImp._parse_smali(
+            "invoke-virtual/range {v1:v3}, Lcom/example/Helper.run(I)V ; 0x5"
+        )
+        assert result == BytecodeObject(
+            "invoke-virtual/range",
+            ["v1", "v3"],
+            "Lcom/example/Helper;->run(I)V",
+        )
+
+    def test_parse_smali_with_invoke(self):
+        result = RizinImp._parse_smali(
+            "invoke-virtual {v0, v1}, Ljava/lang/String.length()I ; 0x3"
+        )
+        assert result == BytecodeObject(
+            "invoke-virtual", ["v0", "v1"], "Ljava/lang/String;->length()I"
+        )
+
+        result = RizinImp._parse_smali("invoke-static {}, Lcom/example/A.b()V ; 0x1")
+        assert result == BytecodeObject("invoke-static", [], "Lcom/example/A;->b()V")
+
+    def test_parse_smali_without_invoke(self):
+        result = RizinImp._parse_smali(
+            "iput-object v5, v8, Lcom/example/A.mName Ljava/lang/String;"
+        )
+
+        # Only invoke instructions rewrite "." into ";->"
+        assert result == BytecodeObject(
+            "iput-object", ["v5", "v8"], "Lcom/example/A.mName Ljava/lang/String;"
+        )
+        assert RizinImp._parse_smali("return-void") == BytecodeObject(
+            "return-void", None, None
+        )
@@ -5,6 +5,7 @@ import pytest
 import requests
 from quark.core.apkinfo import AndroguardImp as Apkinfo
 from quark.core.quark import MAX_SEARCH_LAYER
+from quark.core.struct.methodobject import MethodObject
 from quark.utils.output import (
     get_rule_classification_data,
     output_parent_function_graph,
@@ -137,6 +138,40 @@ def test_get_rule_classification_data_with_referenced_crime(
     assert reference_dict[expected_parent_2] == {expected_parent_1}
 
 
+def test_get_rule_classification_data_with_sibling_call_chains():
+    def method(name):
+        return MethodObject("Lcom/example/Sample;", name, "()V")
+
+    root, left, right = method("root"), method("left"), method("right")
+    left_child, right_child = method("leftChild"), method("rightChild")
+    left_parent, right_parent = method("leftParent"), method("rightParent")
+
+    call_graph = {
+        root: {(left, 0), (right, 2)},
+        left: {(left_child, 0)},
+        right: {(right_child, 0)},
+        left_child: {(left_parent, 0)},
+        right_child: {(right_parent, 0)},
+    }
+
+    class StubApkinfo:
+        @staticmethod
+        def lowerfunc(function):
+            return call_graph.get(function, set())
+
+    apkinfo = StubApkinfo()
+    crime_list = [
+        {"parent": parent, "crime": "The Crime", "apkinfo": apkinfo}
+        for parent in (root, left_parent, right_parent)
+    ]
+
+    _, reference_dict = get_rule_classification_data(crime_list, 3)
+
+    assert reference_dict[root] == {left_parent, right_parent}
+    assert reference_dict[left_parent] == set()
+    assert reference_dict[right_parent] == set()
+
+
 def test_get_rule_classification_data_with_duplicate_crime(
     duplicate_crime_list,
 ):
@@ -60,3 +60,12 @@ def test_contains_with_correct_sequence():
     result = contains(subset, target)
 
     assert result is True
+
+
+def test_contains_with_consecutive_unrelated_elements():
+    subset = ["getCellLocation", "sendTextMessage"]
+    target = ["getCellLocation", "put", "query", "sendTextMessage"]
+
+    result = contains(subset, target)
+
+    assert result is True